@@ -5,11 +5,18 @@ Parses EFSA/Wageningen ECRFS library:
   - ECRFS_metadata_final.csv → toxicological & chemical metadata
 """
 import re
-import csv
+import functools
 import logging
+import mmap
+import os
 import threading
+from dataclasses import dataclass
+from array import array
 from pathlib import Path
-from typing import Any, List, Dict, Optional
+from typing import Any, List, Dict, Optional, Tuple, Union
+
+import numpy as np
+from sklearn.decomposition import PCA
 
 # matchms emits a lot of WARNING-level noise (missing precursor_mz, etc.)
 # that is expected for bulk public databases — suppress below ERROR.
@@ -22,87 +29,326 @@ CSV_FILE  = DATASETS_DIR / "ECRFS_metadata_final.csv"
 # In-memory caches (loaded once per process)
 _spectra_cache: Optional[List[Dict]] = None
 _csv_cache:     Optional[Dict[str, Dict]] = None
-_library_cache: Optional[List[Dict]] = None
+_library_cache: Optional[List["LibraryEntry"]] = None
 
 # Per-library caches for non-default libraries (keyed by mgf stem)
 _extra_spectra_cache: Dict[str, List[Dict]] = {}
-_extra_library_cache: Dict[str, List[Dict]] = {}
+_extra_library_cache: Dict[str, List["LibraryEntry"]] = {}
+
+# Ion notation suffix in MGF names ('[M+H]+', '[M-H]-') and CAS numbers
+_ADDUCT_RE = re.compile(r"\s*\[M[+\-][^\]]+\][+\-]?\s*$")
+_CAS_RE    = re.compile(r"\d+-\d+-\d+")
 
 
 # ──────────────────────────────────────────────────────────────
 #  Parsers
 # ──────────────────────────────────────────────────────────────
 
+def _cache_files(source: Path, *suffixes: str) -> List[Path]:
+    """Cache files for a source file, in a .cache folder next to it."""
+    cache_dir = source.parent / ".cache"
+    return [cache_dir / f"{source.name}{suffix}" for suffix in suffixes]
+
+
+def _source_stamp(source: Path) -> Dict[str, int]:
+    """Size and mtime (ns) of a source file, stored with its cache.
+
+    The cache is reused only on an exact match: a newer-mtime check alone
+    would keep serving it after the source is replaced by an older file
+    (cp -p, git checkout)."""
+    st = source.stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _write_cache_file(path: Path, write) -> None:
+    """Write a cache file atomically (temp file + rename); write(fh) fills it."""
+    path.parent.mkdir(exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as fh:
+        write(fh)
+    os.replace(tmp, path)
+
+
+def _packed_spectra(mz: "np.ndarray", intensity: "np.ndarray",
+                    offsets: List[int], metadata: List[Dict]) -> List[Dict]:
+    """Spectrum dicts whose peaks are views of the packed per-library buffers."""
+    return [
+        {"peaks": {"mz": mz[a:b], "intensity": intensity[a:b]}, "metadata": m}
+        for m, a, b in zip(metadata, offsets[:-1], offsets[1:])
+    ]
+
+
 def _parse_mgf(path: Optional[Path] = None) -> List[Dict]:
-    """Parse an MGF file and return a list of spectrum dicts."""
-    spectra: List[Dict] = []
+    """
+    Parsed MGF spectra, served from an on-disk cache when it is up to date.
+
+    Peaks of the whole library live in two contiguous float64 buffers
+    indexed by an offset table; spectrum i's mz/intensity are views of the
+    [offsets[i], offsets[i+1]) slice.  Both stay float64, so get_spectrum and
+    the matchms scores see the values exactly as parsed from the MGF; m/z in
+    particular is tokenised as "peak@{mz:.2f}", where float32 rounding would
+    move values such as 123.455 across the 2-decimal boundary.
+
+    Cache layout (next to the MGF, in .cache/):
+      <file>.mz.npy          float64 (total_peaks,)
+      <file>.intensity.npy   float64 (total_peaks,)
+      <file>.meta.json       {"source": {size, mtime_ns}, "offsets": [...], "metadata": [...]}
+    The buffers are memory-mapped, so a warm start copies nothing and worker
+    processes share the same pages.
+    """
+    import orjson
 
-    with open(path or MGF_FILE, "r", encoding="utf-8", errors="replace") as fh:
-        content = fh.read()
+    source = path or MGF_FILE
+    mz_file, int_file, meta_file = _cache_files(
+        source, ".mz.npy", ".intensity.npy", ".meta.json"
+    )
 
-    blocks = re.split(r"BEGIN IONS", content)
-    for block in blocks[1:]:
-        end_idx = block.find("END IONS")
-        if end_idx == -1:
-            continue
-        block = block[:end_idx].strip()
+    stamp = _source_stamp(source)
+    try:
+        meta = orjson.loads(meta_file.read_bytes())
+        if meta["source"] == stamp:
+            mz        = np.load(mz_file, mmap_mode="r")
+            intensity = np.load(int_file, mmap_mode="r")
+            if (len(mz) == len(intensity) == meta["offsets"][-1]
+                    and intensity.dtype == np.float64):
+                return _packed_spectra(mz, intensity, meta["offsets"], meta["metadata"])
+    except (OSError, ValueError, KeyError, IndexError):
+        pass        # missing, stale or unreadable cache: re-parse and rewrite it below
+
+    spectra = _read_mgf(source)
+    if not spectra:
+        return spectra
+
+    counts    = [len(sp["peaks"]["mz"]) for sp in spectra]
+    offsets   = np.concatenate(([0], np.cumsum(counts))).tolist()
+    mz        = np.concatenate([sp["peaks"]["mz"] for sp in spectra])
+    intensity = np.concatenate([sp["peaks"]["intensity"] for sp in spectra])
+    meta      = {"source": stamp, "offsets": offsets, "metadata": [sp["metadata"] for sp in spectra]}
+    try:
+        _write_cache_file(mz_file, lambda fh: np.save(fh, mz))
+        _write_cache_file(int_file, lambda fh: np.save(fh, intensity))
+        _write_cache_file(meta_file, lambda fh: fh.write(orjson.dumps(meta)))
+    except OSError:
+        pass        # read-only datasets dir: just run uncached
+    return _packed_spectra(mz, intensity, offsets, meta["metadata"])
+
+
+# Bytes allowed before a marker on its line: whitespace and the UTF-8 BOM
+# that opens a file (or a file concatenated into it)
+_MARKER_PAD = frozenset(b" \t\x0b\x0c\xef\xbb\xbf")
+
+
+def _find_marker(buf, marker: bytes, start: int, end: int) -> int:
+    """Offset of the next line starting with ``marker`` (after optional
+    whitespace or a UTF-8 BOM) in buf[start:end], or -1."""
+    pos = buf.find(marker, start, end)
+    while pos != -1:
+        # Walk back over the line's leading bytes only (never to the file start)
+        i = pos
+        while i > 0 and buf[i - 1] in _MARKER_PAD:
+            i -= 1
+        if i == 0 or buf[i - 1] in b"\r\n":
+            return pos
+        pos = buf.find(marker, pos + len(marker), end)
+    return pos
+
+
+def _read_mgf(path: Path) -> List[Dict]:
+    """Parse an MGF file and return a list of spectrum dicts.
+
+    The file is memory-mapped and scanned as bytes: BEGIN IONS / END IONS
+    blocks are located with find(), peak lines go straight to float() on the
+    raw bytes, and only metadata keys/values are decoded (UTF-8).  A block
+    that is not closed before the next BEGIN IONS or the end of file is
+    dropped.
+
+    Peaks are stored column-wise (SoA): ``spectrum["peaks"]`` is
+    ``{"mz": ndarray, "intensity": ndarray}`` (float64), filled through two
+    ``array('d')`` buffers while parsing.
+    """
+    spectra: List[Dict] = []
 
-        spectrum: Dict = {"peaks": [], "metadata": {}}
-        for line in block.splitlines():
-            line = line.strip()
-            if not line:
+    with open(path, "rb") as fh:
+        try:
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:      # empty file: nothing to map
+            return spectra
+
+    with mm:
+        size  = len(mm)
+        begin = _find_marker(mm, b"BEGIN IONS", 0, size)
+        while begin != -1:
+            end = _find_marker(mm, b"END IONS", begin, size)
+            if end == -1:
+                break
+            nxt = _find_marker(mm, b"BEGIN IONS", begin + 10, end)
+            if nxt != -1:
+                begin = nxt     # unterminated block: restart from the next one
                 continue
 
-            # Peak line: two floating-point numbers separated by whitespace
-            parts = line.split()
-            if len(parts) == 2:
-                try:
-                    mz = float(parts[0])
-                    intensity = float(parts[1])
-                    spectrum["peaks"].append({"mz": mz, "intensity": intensity})
-                    continue
-                except ValueError:
-                    pass
+            metadata: Dict[str, str] = {}
+            mz_buf, int_buf = array("d"), array("d")
 
-            # Metadata line: KEY=VALUE
-            if "=" in line:
-                key, _, value = line.partition("=")
-                spectrum["metadata"][key.strip()] = value.strip()
+            # First line is the BEGIN IONS marker itself
+            for line in mm[begin:end].splitlines()[1:]:
+                line = line.strip()
+                if not line:
+                    continue
 
-        if spectrum["metadata"].get("NAME"):
-            spectra.append(spectrum)
+                # Peak line: two floating-point numbers separated by whitespace
+                parts = line.split()
+                if len(parts) == 2:
+                    try:
+                        mz = float(parts[0])
+                        intensity = float(parts[1])
+                        mz_buf.append(mz)
+                        int_buf.append(intensity)
+                        continue
+                    except ValueError:
+                        pass
+
+                # Metadata line: KEY=VALUE
+                if b"=" in line:
+                    key, _, value = line.partition(b"=")
+                    metadata[key.decode("utf-8", "replace").strip()] = \
+                        value.decode("utf-8", "replace").strip()
+
+            if metadata.get("NAME"):
+                spectra.append({
+                    "peaks": {
+                        "mz":        np.frombuffer(mz_buf, dtype=np.float64),
+                        "intensity": np.frombuffer(int_buf, dtype=np.float64),
+                    },
+                    "metadata": metadata,
+                })
+            begin = _find_marker(mm, b"BEGIN IONS", end, size)
 
     return spectra
 
 
 def _parse_csv(path: Optional[Path] = None) -> Dict[str, Dict]:
     """Parse a semicolon-separated metadata CSV keyed by lowercase compound name.
-    Returns an empty dict if the file does not exist (CSV is optional)."""
+    Returns an empty dict if the file does not exist (CSV is optional).
+    The parsed dict is pickled to .cache/<file>.pkl, together with the CSV's
+    size and mtime, and reused while those match."""
+    import pickle
+
     target = path or CSV_FILE
     if not target.exists():
         return {}
-    metadata: Dict[str, Dict] = {}
-    with open(target, "r", encoding="utf-8-sig", errors="replace") as fh:
-        reader = csv.DictReader(fh, delimiter=";")
-        for row in reader:
-            name = (row.get("Name") or "").strip()
-            if name:
-                metadata[name.lower()] = {k.strip(): (v or "").strip() for k, v in row.items()}
+
+    (pickle_file,) = _cache_files(target, ".pkl")
+    stamp = _source_stamp(target)
+    try:
+        with open(pickle_file, "rb") as fh:
+            cached = pickle.load(fh)
+        if isinstance(cached, dict) and cached.get("source") == stamp:
+            return cached["metadata"]
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass        # missing or unreadable cache: re-parse and rewrite it below
+
+    metadata = _read_csv(target)
+    try:
+        _write_cache_file(pickle_file, lambda fh: pickle.dump(
+            {"source": stamp, "metadata": metadata}, fh, protocol=5))
+    except OSError:
+        pass        # read-only datasets dir: just run uncached
     return metadata
 
 
+def _read_csv(target: Path) -> Dict[str, Dict]:
+    """
+    Vectorised parse of the metadata CSV (see _parse_csv): pandas with the
+    pyarrow engine when available (C engine for files with ragged rows),
+    every cell kept as a stripped string.
+    Rows without a Name are skipped; on duplicate names the last row wins.
+    """
+    import io
+    import pandas as pd
+    try:
+        import pyarrow  # noqa: F401
+        engines = ("pyarrow", "c")
+    except ImportError:
+        engines = ("c",)
+
+    text = target.read_bytes().decode("utf-8-sig", errors="replace")
+    for engine in engines:
+        try:
+            df = pd.read_csv(io.StringIO(text), sep=";", dtype=str,
+                             keep_default_na=False, engine=engine)
+            break
+        except ValueError:
+            # pyarrow rejects ragged rows; the C parser pads them
+            if engine == engines[-1]:
+                raise
+    df = df.fillna("")
+    df.columns = df.columns.str.strip()
+    if "Name" not in df.columns:
+        return {}
+    df = df.apply(lambda col: col.str.strip())
+    df = df[df["Name"] != ""]
+    return dict(zip(df["Name"].str.lower(), df.to_dict("records")))
+
+
+def _peak_arrays(peaks: Union[List[Dict], Dict]) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Normalise a peak list to two float arrays (mz, intensity).
+    Accepts the list-of-dicts form [{mz, intensity}, ...] as well as the
+    columnar form {"mz": [...], "intensity": [...]}, which API clients can
+    send to skip building one dict per peak.
+    """
+    if isinstance(peaks, dict):
+        mz  = np.asarray(peaks.get("mz", []), dtype=float)
+        ints = np.asarray(peaks.get("intensity", []), dtype=float)
+        if mz.shape != ints.shape:
+            raise ValueError("peaks.mz and peaks.intensity must have the same length")
+        return mz, ints
+
+    n   = len(peaks)
+    mz  = np.fromiter((p["mz"] for p in peaks), dtype=float, count=n)
+    ints = np.fromiter((p["intensity"] for p in peaks), dtype=float, count=n)
+    return mz, ints
+
+
 def _strip_adduct(name: str) -> str:
     """Remove ion notation like '[M+H]+', '[M-H]-' from MGF compound names."""
-    return re.sub(r"\s*\[M[+\-][^\]]+\][+\-]?\s*$", "", name).strip()
+    return _ADDUCT_RE.sub("", name).strip()
 
 
 # ──────────────────────────────────────────────────────────────
 #  Public API
 # ──────────────────────────────────────────────────────────────
 
-def _build_library(spectra: List[Dict], csv_data: Dict[str, Dict]) -> List[Dict]:
+@dataclass(slots=True, frozen=True)
+class LibraryEntry:
+    """
+    One library record: MGF spectrum metadata merged with its CSV row.
+    Slotted and immutable (records are cached and shared between requests);
+    orjson serialises it as a JSON object with these field names.
+    """
+    id: int
+    name: str
+    mgf_name: str
+    formula: str
+    exact_mass: str
+    smiles: str
+    inchikey: str
+    cas: str
+    pubchem: str
+    tox_score: str
+    tox_reliability: str
+    tox_endpoint: str
+    retention_time: str
+    ionmode: str
+    instrument: str
+    activation: str
+    spectrum_quality: str
+    peak_count: int
+
+
+def _build_library(spectra: List[Dict], csv_data: Dict[str, Dict]) -> List[LibraryEntry]:
     """Merge a list of parsed MGF spectra with CSV metadata into library records."""
-    library: List[Dict] = []
+    library: List[LibraryEntry] = []
     for i, spectrum in enumerate(spectra):
         meta = spectrum["metadata"]
         mgf_name   = meta.get("NAME", f"Unknown_{i}")
@@ -115,7 +361,7 @@ def _build_library(spectra: List[Dict], csv_data: Dict[str, Dict]) -> List[Dict]
             tokens = notes.split(":")
             if len(tokens) >= 3:
                 candidate = tokens[2].strip()
-                if re.match(r"\d+-\d+-\d+", candidate):
+                if _CAS_RE.match(candidate):
                     cas = candidate
 
         tox_score    = csv_row.get("EFSA Tox Score", "N/A")
@@ -124,30 +370,30 @@ def _build_library(spectra: List[Dict], csv_data: Dict[str, Dict]) -> List[Dict]
         if not tox_endpoint or tox_endpoint == "N/A":
             tox_endpoint = csv_row.get("Endpoint for basis of scoring", "N/A")
 
-        library.append({
-            "id":              i,
-            "name":            clean_name,
-            "mgf_name":        mgf_name,
-            "formula":         csv_row.get("Molecular Formula", meta.get("FORMULA", "N/A")),
-            "exact_mass":      meta.get("EXACTMASS", "N/A"),
-            "smiles":          meta.get("SMILES", csv_row.get("SMILES", "N/A")),
-            "inchikey":        meta.get("INCHI", csv_row.get("StdInChIKey", "N/A")),
-            "cas":             cas,
-            "pubchem":         csv_row.get("PubChem", "N/A"),
-            "tox_score":       tox_score,
-            "tox_reliability": tox_rel,
-            "tox_endpoint":    tox_endpoint,
-            "retention_time":  meta.get("RTINSECONDS", "N/A"),
-            "ionmode":         meta.get("IONMODE", "N/A"),
-            "instrument":      meta.get("SOURCE_INSTRUMENT", meta.get("INSTRUMENT", "N/A")),
-            "activation":      meta.get("ACTIVATION", "N/A"),
-            "spectrum_quality": meta.get("LIBRARYQUALITY", "N/A"),
-            "peak_count":      len(spectrum["peaks"]),
-        })
+        library.append(LibraryEntry(
+            id=i,
+            name=clean_name,
+            mgf_name=mgf_name,
+            formula=csv_row.get("Molecular Formula", meta.get("FORMULA", "N/A")),
+            exact_mass=meta.get("EXACTMASS", "N/A"),
+            smiles=meta.get("SMILES", csv_row.get("SMILES", "N/A")),
+            inchikey=meta.get("INCHI", csv_row.get("StdInChIKey", "N/A")),
+            cas=cas,
+            pubchem=csv_row.get("PubChem", "N/A"),
+            tox_score=tox_score,
+            tox_reliability=tox_rel,
+            tox_endpoint=tox_endpoint,
+            retention_time=meta.get("RTINSECONDS", "N/A"),
+            ionmode=meta.get("IONMODE", "N/A"),
+            instrument=meta.get("SOURCE_INSTRUMENT", meta.get("INSTRUMENT", "N/A")),
+            activation=meta.get("ACTIVATION", "N/A"),
+            spectrum_quality=meta.get("LIBRARYQUALITY", "N/A"),
+            peak_count=len(spectrum["peaks"]["mz"]),
+        ))
     return library
 
 
-def get_library(lib_id: Optional[str] = None) -> List[Dict]:
+def get_library(lib_id: Optional[str] = None) -> List[LibraryEntry]:
     """
     Return merged library: MGF spectra + optional CSV metadata.
     lib_id is the MGF filename stem (e.g. 'ECRFS_library_final').
@@ -212,112 +458,151 @@ def _spectrum_to_embedding(spectrum: Dict, intensity_power: float = 0.5) -> "np.
     Embedding: intensity-weighted average of token vectors (weight = intensity^power),
     then L2-normalised.  Peaks whose token is OOV are skipped.
     """
-    import numpy as np
+    return _embed_spectra([spectrum], intensity_power)[0]
 
-    wv   = _load_spec2vec_wv()
-    dim  = wv.vector_size          # 300
-    peaks = spectrum["peaks"]
-    if not peaks:
-        return np.zeros(dim)
 
-    max_i = max(p["intensity"] for p in peaks) or 1.0
-    vec   = np.zeros(dim, dtype=float)
-    total_weight = 0.0
+def _embed_spectra(spectra: List[Dict], intensity_power: float = 0.5) -> "np.ndarray":
+    """
+    Batched _spectrum_to_embedding: one (n, dim) matrix, row i = spectra[i].
 
-    for p in peaks:
-        token  = f"peak@{p['mz']:.2f}"
-        if token not in wv:
-            continue
-        weight = (p["intensity"] / max_i) ** intensity_power
-        vec   += weight * wv[token]
-        total_weight += weight
+    All peaks are tokenised in one pass; the weighted sums for every
+    spectrum are a single sparse (spectra x used tokens) @ (used tokens x dim)
+    product, so only the vocabulary rows actually hit are read from the
+    memory-mapped vector table.  Spectra with no known peak get a zero row.
+    """
+    from scipy.sparse import csr_matrix
+
+    wv   = _load_spec2vec_wv()
+    dim  = wv.vector_size          # 300
+    n    = len(spectra)
+    out  = np.zeros((n, dim))
+
+    arrays = [_peak_arrays(sp["peaks"]) for sp in spectra]
+    counts = np.fromiter((len(mz) for mz, _ in arrays), dtype=np.intp, count=n)
+    if not counts.sum():
+        return out
+
+    mz   = np.concatenate([a[0] for a in arrays])
+    ints = np.concatenate([a[1] for a in arrays])
+    rows = np.repeat(np.arange(n), counts)
+
+    # Per-spectrum max intensity over the contiguous peak segments
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    max_i  = np.ones(n)
+    nonempty = counts > 0
+    max_i[nonempty] = np.maximum.reduceat(ints, starts[nonempty])
+    max_i[max_i == 0] = 1.0
+
+    # Vocabulary lookup per token (-1 = OOV, dropped)
+    key_to_index = wv.key_to_index
+    idx   = np.fromiter(
+        (key_to_index.get(f"peak@{m:.2f}", -1) for m in mz.tolist()),
+        dtype=np.intp, count=len(mz),
+    )
+    known = idx >= 0
+    if not known.any():
+        return out
+    rows, idx = rows[known], idx[known]
 
-    if total_weight > 0:
-        vec /= total_weight
+    weights    = (ints[known] / max_i[rows]) ** intensity_power
+    vocab, col = np.unique(idx, return_inverse=True)
+    W   = csr_matrix((weights, (rows, col)), shape=(n, len(vocab)))
+    out = np.asarray(W @ wv.vectors[vocab].astype(float))
 
-    norm = float(np.linalg.norm(vec))
-    if norm > 0:
-        vec /= norm
-    return vec
+    # The weighted average's division by the total weight is a per-row scale,
+    # absorbed by the L2 normalisation: one pass over the matrix is enough
+    norms = np.linalg.norm(out, axis=1)
+    has_norm = norms > 0
+    out[has_norm] /= norms[has_norm, None]
+    return out
 
 
 
 _pca_model_cache = None
 _extra_pca_cache: Dict[str, Any] = {}
 _extra_embeddings_3d_cache: Dict[str, List[Dict]] = {}
+_embedding_matrix_cache: Dict[str, "np.ndarray"] = {}   # keyed by mgf stem
+_pca_coords_cache: Dict[str, "np.ndarray"] = {}         # keyed by mgf stem
+
+
+def _get_spectra(lib_id: Optional[str] = None) -> List[Dict]:
+    """Parsed spectra of the given library (default: ECRFS), cached per process."""
+    global _spectra_cache, _extra_spectra_cache
+
+    if lib_id and lib_id != MGF_FILE.stem:
+        if lib_id not in _extra_spectra_cache:
+            mgf_path = DATASETS_DIR / f"{lib_id}.mgf"
+            if not mgf_path.exists():
+                raise ValueError(f"Library '{lib_id}' not found")
+            _extra_spectra_cache[lib_id] = _parse_mgf(mgf_path)
+        return _extra_spectra_cache[lib_id]
+
+    if _spectra_cache is None:
+        _spectra_cache = _parse_mgf()
+    return _spectra_cache
+
+
+def _get_embedding_matrix(lib_id: Optional[str] = None) -> "np.ndarray":
+    """
+    (n, 300) Spec2Vec matrix of the given library, row i = spectrum i.
+    Built once per library and shared by every embedding consumer (PCA,
+    3-D coordinates, LOF, similarity search); read-only.
+    """
+    key = lib_id or MGF_FILE.stem
+    matrix = _embedding_matrix_cache.get(key)
+    if matrix is None:
+        matrix = _embed_spectra(_get_spectra(lib_id))
+        matrix.flags.writeable = False
+        _embedding_matrix_cache[key] = matrix
+    return matrix
 
 
 def _get_pca(lib_id: Optional[str] = None):
-    """Fit (once per library) and cache PCA on the library embeddings."""
-    import numpy as np
-    from sklearn.decomposition import PCA
-    global _pca_model_cache, _spectra_cache, _extra_pca_cache, _extra_spectra_cache
+    """Fit (once per library) and cache PCA on the library embeddings.
+    The library's own 3-D coordinates come from the same fit_transform call
+    and are kept in _pca_coords_cache (no second pass over the matrix)."""
+    global _pca_model_cache, _extra_pca_cache
 
     if lib_id and lib_id != MGF_FILE.stem:
         if lib_id in _extra_pca_cache:
             return _extra_pca_cache[lib_id]
-        if lib_id not in _extra_spectra_cache:
-            _extra_spectra_cache[lib_id] = _parse_mgf(DATASETS_DIR / f"{lib_id}.mgf")
-        matrix = np.array([_spectrum_to_embedding(sp) for sp in _extra_spectra_cache[lib_id]])
+        matrix = _get_embedding_matrix(lib_id)
         pca = PCA(n_components=3, random_state=42)
-        pca.fit(matrix)
+        _pca_coords_cache[lib_id] = pca.fit_transform(matrix)
         _extra_pca_cache[lib_id] = pca
         return pca
 
     if _pca_model_cache is not None:
         return _pca_model_cache
-    if _spectra_cache is None:
-        _spectra_cache = _parse_mgf()
-    matrix = np.array([_spectrum_to_embedding(sp) for sp in _spectra_cache])
+    matrix = _get_embedding_matrix()
     pca = PCA(n_components=3, random_state=42)
-    pca.fit(matrix)
+    _pca_coords_cache[MGF_FILE.stem] = pca.fit_transform(matrix)
     _pca_model_cache = pca
     return pca
 
 
 def get_embedding(spectrum_id: int, lib_id: Optional[str] = None) -> Dict:
     """Return the 300-D embedding for one spectrum from the given library."""
-    import numpy as np
-    global _spectra_cache, _extra_spectra_cache
-
-    if lib_id and lib_id != MGF_FILE.stem:
-        if lib_id not in _extra_spectra_cache:
-            mgf_path = DATASETS_DIR / f"{lib_id}.mgf"
-            if not mgf_path.exists():
-                raise ValueError(f"Library '{lib_id}' not found")
-            _extra_spectra_cache[lib_id] = _parse_mgf(mgf_path)
-        spectra = _extra_spectra_cache[lib_id]
-    else:
-        if _spectra_cache is None:
-            _spectra_cache = _parse_mgf()
-        spectra = _spectra_cache
+    matrix = _get_embedding_matrix(lib_id)
 
-    if spectrum_id < 0 or spectrum_id >= len(spectra):
+    if spectrum_id < 0 or spectrum_id >= len(matrix):
         raise ValueError(f"Spectrum ID {spectrum_id} out of range")
-    vec = _spectrum_to_embedding(spectra[spectrum_id])
+    vec = matrix[spectrum_id]
     return {"embedding": vec.tolist(), "dimensions": int(vec.shape[0])}
 
 
 def get_embeddings_3d(lib_id: Optional[str] = None) -> List[Dict]:
     """Return PCA-reduced 3-D coordinates for all molecules in the given library."""
-    import numpy as np
-    global _spectra_cache, _embeddings_3d_cache, _extra_spectra_cache, _extra_embeddings_3d_cache
+    global _embeddings_3d_cache, _extra_embeddings_3d_cache
 
     if lib_id and lib_id != MGF_FILE.stem:
         if lib_id in _extra_embeddings_3d_cache:
             return _extra_embeddings_3d_cache[lib_id]
-        if lib_id not in _extra_spectra_cache:
-            mgf_path = DATASETS_DIR / f"{lib_id}.mgf"
-            if not mgf_path.exists():
-                raise ValueError(f"Library '{lib_id}' not found")
-            _extra_spectra_cache[lib_id] = _parse_mgf(mgf_path)
-        spectra = _extra_spectra_cache[lib_id]
         library = get_library(lib_id)
-        pca     = _get_pca(lib_id)
-        matrix  = np.array([_spectrum_to_embedding(sp) for sp in spectra])
-        coords  = pca.transform(matrix)
-        result  = [{"id": i, "name": mol["name"], "formula": mol["formula"],
-                    "tox_score": mol["tox_score"],
+        _get_pca(lib_id)
+        coords  = _pca_coords_cache[lib_id]
+        result  = [{"id": i, "name": mol.name, "formula": mol.formula,
+                    "tox_score": mol.tox_score,
                     "x": float(c[0]), "y": float(c[1]), "z": float(c[2])}
                    for i, (c, mol) in enumerate(zip(coords, library))]
         _extra_embeddings_3d_cache[lib_id] = result
@@ -325,16 +610,13 @@ def get_embeddings_3d(lib_id: Optional[str] = None) -> List[Dict]:
 
     if _embeddings_3d_cache is not None:
         return _embeddings_3d_cache
-    if _spectra_cache is None:
-        _spectra_cache = _parse_mgf()
-    pca    = _get_pca()
-    matrix = np.array([_spectrum_to_embedding(sp) for sp in _spectra_cache])
-    coords = pca.transform(matrix)
+    _get_pca()
+    coords = _pca_coords_cache[MGF_FILE.stem]
     library = get_library()
     result: List[Dict] = []
     for i, (c, mol) in enumerate(zip(coords, library)):
-        result.append({"id": i, "name": mol["name"], "formula": mol["formula"],
-                       "tox_score": mol["tox_score"],
+        result.append({"id": i, "name": mol.name, "formula": mol.formula,
+                       "tox_score": mol.tox_score,
                        "x": float(c[0]), "y": float(c[1]), "z": float(c[2])})
     _embeddings_3d_cache = result
     return result
@@ -346,8 +628,6 @@ def project_query_to_3d(query_peaks: List[Dict], label: str = "Query",
     Project a query MS2 spectrum into the PCA 3-D space of the given library.
     Query peaks land in the same coordinate frame as the library molecules.
     """
-    import numpy as np
-
     vec    = _spectrum_to_embedding({"peaks": query_peaks})
     pca    = _get_pca(lib_id)
     coords = pca.transform(vec.reshape(1, -1))[0]
@@ -356,31 +636,53 @@ def project_query_to_3d(query_peaks: List[Dict], label: str = "Query",
 
 def get_all_embeddings() -> List[Dict]:
     """Return {id, name, formula, tox_score, embedding} for all 102 molecules."""
-    global _spectra_cache
-    if _spectra_cache is None:
-        _spectra_cache = _parse_mgf()
-
     library = get_library()
+    matrix  = _get_embedding_matrix()
     result = []
-    for i, (sp, mol) in enumerate(zip(_spectra_cache, library)):
-        import numpy as np
-        vec = _spectrum_to_embedding(sp)
+    for i, (vec, mol) in enumerate(zip(matrix, library)):
         result.append({
             "id":        i,
-            "name":      mol["name"],
-            "formula":   mol["formula"],
-            "tox_score": mol["tox_score"],
+            "name":      mol.name,
+            "formula":   mol.formula,
+            "tox_score": mol.tox_score,
             "embedding": vec.tolist(),
         })
     return result
 
 
+def get_all_embeddings_int8() -> bytes:
+    """
+    Binary, int8-quantised version of get_all_embeddings() (library order).
+
+    Layout (little-endian):
+      uint32 n, uint32 dim
+      float32[n]      per-vector scale — embedding[i] ≈ q[i] * scale[i]
+      int8[n * dim]   quantised vectors, row-major
+
+    Each vector is scaled so that its largest |component| maps to 127.
+    Cosine similarity is invariant to the per-vector scale, so clients can
+    compare rows directly on the int8 data.
+    """
+    import struct
+
+    matrix = _get_embedding_matrix()
+    n, dim = matrix.shape if matrix.size else (0, 0)
+    peak   = np.abs(matrix).max(axis=1) if n else np.zeros(0)
+    scale  = np.where(peak > 0, peak / 127.0, 0.0)
+    safe   = np.where(scale > 0, scale, 1.0)[:, None]
+    q      = np.clip(np.rint(matrix / safe), -127, 127).astype(np.int8)
+
+    return (struct.pack("<II", n, dim)
+            + scale.astype("<f4").tobytes()
+            + q.tobytes())
+
+
 def list_libraries() -> List[Dict]:
     """List available spectral libraries (MGF files) in the datasets folder."""
     libs = []
     for mgf in sorted(DATASETS_DIR.glob("*.mgf")):
         try:
-            n_spectra = mgf.read_text(encoding="utf-8", errors="replace").count("BEGIN IONS")
+            n_spectra = mgf.read_text(encoding="utf-8-sig", errors="replace").count("BEGIN IONS")
         except Exception:
             n_spectra = 0
         csv_path = DATASETS_DIR / f"{mgf.stem}.csv"
@@ -394,19 +696,43 @@ def list_libraries() -> List[Dict]:
     return libs
 
 
+def chromatograms_version() -> int:
+    """Mtime (ns) of the dataset folder: changes when files are added/removed."""
+    return DATASETS_DIR.stat().st_mtime_ns
+
+
 def list_chromatograms() -> List[str]:
     """List all .json chromatogram files in the deep_spectrum dataset folder."""
-    return [f.name for f in sorted(DATASETS_DIR.glob("*.json"))]
+    return list(_list_chromatograms_cached(DATASETS_DIR, chromatograms_version()))
+
+
+@functools.lru_cache(maxsize=1)
+def _list_chromatograms_cached(folder: Path, version: int) -> Tuple[str, ...]:
+    # version only keys the cache: a new folder mtime triggers a rescan
+    return tuple(f.name for f in sorted(folder.glob("*.json")))
 
 
 def get_chromatogram(filename: str) -> Dict:
-    """Return the parsed chromatogram JSON for a given filename."""
+    """Return the parsed chromatogram JSON for a given filename.
+    Parsed files are memoised per (path, mtime): the returned dict is shared
+    between requests and must not be modified."""
     path = DATASETS_DIR / filename
     if not path.exists() or path.suffix != ".json":
         raise ValueError(f"Chromatogram '{filename}' not found")
-    import json as _json
-    with open(path, "r", encoding="utf-8") as fh:
-        return _json.load(fh)
+    return _load_chromatogram(path, path.stat().st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_chromatogram(path: Path, mtime_ns: int) -> Dict:
+    import orjson
+    raw = path.read_bytes()
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        # orjson is strict RFC 8259: files with NaN/Infinity literals still
+        # need the stdlib parser
+        import json as _json
+        return _json.loads(raw.decode("utf-8"))
 
 
 # ──────────────────────────────────────────────────────────────
@@ -421,7 +747,6 @@ def spectral_match(query_peaks: List[Dict], precursor_mz: float,
     Searches against lib_id (MGF stem); defaults to the ECRFS library.
     Returns top_n results sorted by similarity (descending).
     """
-    import numpy as np
     from matchms import Spectrum
     from matchms.filtering import normalize_intensities
     from matchms.similarity import ModifiedCosine
@@ -442,12 +767,11 @@ def spectral_match(query_peaks: List[Dict], precursor_mz: float,
         spectra = _spectra_cache
         library = get_library()
 
-    if not query_peaks:
+    q_mz, q_int = _peak_arrays(query_peaks)
+    if not len(q_mz):
         return []
 
     # Build matchms query Spectrum
-    q_mz  = np.array([p["mz"]       for p in query_peaks], dtype=float)
-    q_int = np.array([p["intensity"] for p in query_peaks], dtype=float)
     order = np.argsort(q_mz)
     query = Spectrum(mz=q_mz[order], intensities=q_int[order],
                      metadata={"precursor_mz": float(precursor_mz)})
@@ -457,12 +781,10 @@ def spectral_match(query_peaks: List[Dict], precursor_mz: float,
     results = []
 
     for i, (spectrum, mol) in enumerate(zip(spectra, library)):
-        lib_peaks = spectrum["peaks"]
-        if not lib_peaks:
+        l_mz, l_int = _peak_arrays(spectrum["peaks"])
+        if not len(l_mz):
             continue
 
-        l_mz  = np.array([p["mz"]       for p in lib_peaks], dtype=float)
-        l_int = np.array([p["intensity"] for p in lib_peaks], dtype=float)
         order = np.argsort(l_mz)
 
         # Precursor m/z: PEPMASS field, else EXACTMASS + H
@@ -490,10 +812,10 @@ def spectral_match(query_peaks: List[Dict], precursor_mz: float,
 
         results.append({
             "id":         i,
-            "name":       mol["name"],
-            "formula":    mol["formula"],
-            "tox_score":  mol["tox_score"],
-            "cas":        mol["cas"],
+            "name":       mol.name,
+            "formula":    mol.formula,
+            "tox_score":  mol.tox_score,
+            "cas":        mol.cas,
             "similarity": round(score, 4),
             "n_matches":  n_matches,
         })
@@ -512,17 +834,13 @@ _lof_calibration  = None   # {"p10": float, "p50": float}
 
 def _get_lof_model():
     """Fit LOF on the 102 ECRFS Spec2Vec embeddings (once per process)."""
-    global _lof_model, _lof_calibration, _spectra_cache
-    import numpy as np
+    global _lof_model, _lof_calibration
     from sklearn.neighbors import LocalOutlierFactor
 
     if _lof_model is not None:
         return _lof_model, _lof_calibration
 
-    if _spectra_cache is None:
-        _spectra_cache = _parse_mgf()
-
-    matrix = np.array([_spectrum_to_embedding(sp) for sp in _spectra_cache])
+    matrix = _get_embedding_matrix()
 
     # novelty=True allows scoring new points without re-fitting
     lof = LocalOutlierFactor(n_neighbors=8, novelty=True, metric="cosine")
@@ -551,13 +869,7 @@ def anomaly_score(query_peaks: List[Dict]) -> Dict:
       max_similarity  – best cosine similarity against any ECRFS compound
       nearest         – top-5 nearest ECRFS compounds by cosine similarity
     """
-    import numpy as np
-    global _spectra_cache
-
-    if _spectra_cache is None:
-        _spectra_cache = _parse_mgf()
-
-    if not query_peaks:
+    if not len(_peak_arrays(query_peaks)[0]):
         return {}
 
     query_vec  = _spectrum_to_embedding({"peaks": query_peaks})
@@ -570,17 +882,17 @@ def anomaly_score(query_peaks: List[Dict]) -> Dict:
 
     # Nearest neighbours in Spec2Vec space
     library = get_library()
+    matrix  = _get_embedding_matrix()
     sims    = sorted(
-        [(float(np.dot(query_vec, _spectrum_to_embedding(sp))), i)
-         for i, sp in enumerate(_spectra_cache)],
+        zip((matrix @ query_vec).tolist(), range(len(matrix))),
         reverse=True,
     )
     nearest = [
         {
             "id":         sims[j][1],
-            "name":       library[sims[j][1]]["name"],
-            "formula":    library[sims[j][1]]["formula"],
-            "tox_score":  library[sims[j][1]]["tox_score"],
+            "name":       library[sims[j][1]].name,
+            "formula":    library[sims[j][1]].formula,
+            "tox_score":  library[sims[j][1]].tox_score,
             "similarity": round(max(0.0, sims[j][0]), 4),
         }
         for j in range(min(5, len(sims)))
@@ -614,38 +926,23 @@ def spec2vec_match(query_peaks: List[Dict], top_n: int = 10,
     Searches against lib_id (MGF stem); defaults to the ECRFS library.
     Returns top_n results sorted by similarity (descending).
     """
-    import numpy as np
-    global _spectra_cache, _extra_spectra_cache
+    matrix  = _get_embedding_matrix(lib_id)
+    library = get_library(lib_id)
 
-    if lib_id and lib_id != MGF_FILE.stem:
-        if lib_id not in _extra_spectra_cache:
-            mgf_path = DATASETS_DIR / f"{lib_id}.mgf"
-            if not mgf_path.exists():
-                raise ValueError(f"Library '{lib_id}' not found")
-            _extra_spectra_cache[lib_id] = _parse_mgf(mgf_path)
-        spectra = _extra_spectra_cache[lib_id]
-        library = get_library(lib_id)
-    else:
-        if _spectra_cache is None:
-            _spectra_cache = _parse_mgf()
-        spectra = _spectra_cache
-        library = get_library()
-
-    if not query_peaks:
+    if not len(_peak_arrays(query_peaks)[0]):
         return []
 
     query_vec = _spectrum_to_embedding({"peaks": query_peaks})
+    sims      = (matrix @ query_vec).tolist()
     results   = []
 
-    for i, (sp, mol) in enumerate(zip(spectra, library)):
-        lib_vec    = _spectrum_to_embedding(sp)
-        similarity = float(np.dot(query_vec, lib_vec))
+    for i, (similarity, mol) in enumerate(zip(sims, library)):
         results.append({
             "id":         i,
-            "name":       mol["name"],
-            "formula":    mol["formula"],
-            "tox_score":  mol["tox_score"],
-            "cas":        mol["cas"],
+            "name":       mol.name,
+            "formula":    mol.formula,
+            "tox_score":  mol.tox_score,
+            "cas":        mol.cas,
             "similarity": round(max(0.0, similarity), 4),
         })
 
@@ -700,7 +997,6 @@ def get_broad_index_status() -> Dict:
 
 def _load_broad_index_from_disk() -> bool:
     """Try to load a pre-built index from disk. Returns True on success."""
-    import numpy as np
     import pickle
     global _broad_vectors, _broad_metadata, _broad_status
 
@@ -727,7 +1023,6 @@ def _load_broad_index_from_disk() -> bool:
 
 def _build_broad_index_worker() -> None:
     """Background thread: download MassBank MSP, embed with Spec2Vec, save index."""
-    import numpy as np
     import pickle
     import urllib.request
 
@@ -800,12 +1095,11 @@ def _build_broad_index_worker() -> None:
         batch    = 200
 
         for i, sp in enumerate(filtered):
-            peaks_dicts = [
-                {"mz": float(mz), "intensity": float(it)}
-                for mz, it in zip(sp.peaks.mz, sp.peaks.intensities)
-            ]
-            vec = _spectrum_to_embedding({"peaks": peaks_dicts})
-            vectors[i] = vec.astype(np.float32)
+            if i % batch == 0:
+                vectors[i:i + batch] = _embed_spectra([
+                    {"peaks": {"mz": s.peaks.mz, "intensity": s.peaks.intensities}}
+                    for s in filtered[i:i + batch]
+                ])
 
             name    = (sp.metadata.get("compound_name")
                        or sp.metadata.get("name") or "Unknown")
@@ -901,12 +1195,10 @@ def spec2vec_broad_match(query_peaks: List[Dict], top_n: int = 10) -> List[Dict]
     Requires the broad index to be built first (start_build_broad_index).
     Returns top_n results sorted by cosine similarity (descending).
     """
-    import numpy as np
-
     if _broad_vectors is None or _broad_metadata is None:
         raise RuntimeError("Broad index not ready. Call /deep-spectrum/build-broad-index first.")
 
-    if not query_peaks:
+    if not len(_peak_arrays(query_peaks)[0]):
         return []
 
     query_vec = _spectrum_to_embedding({"peaks": query_peaks}).astype(np.float32)
@@ -969,16 +1261,17 @@ def massbank_search(
     import urllib.parse
     import json as _json
 
-    if not query_peaks:
+    q_mz, q_int = _peak_arrays(query_peaks)
+    if not len(q_mz):
         return []
 
     # Normalise intensities to 0-999 (MassBank convention)
-    max_i = max(p["intensity"] for p in query_peaks) or 1.0
+    max_i = float(q_int.max()) or 1.0
     params = []
-    for p in query_peaks:
-        rel = round(p["intensity"] / max_i * 999)
+    for mz, it in zip(q_mz.tolist(), q_int.tolist()):
+        rel = round(it / max_i * 999)
         if rel > 10:
-            mz_val = round(p["mz"], 4)
+            mz_val = round(mz, 4)
             params.append("peak_list=" + urllib.parse.quote(f"{mz_val};{rel}"))
 
     if not params:
@@ -1001,14 +1294,11 @@ def massbank_search(
     except Exception:
         return []
 
-    import numpy as np
     from matchms import Spectrum as _Spec
     from matchms.filtering import normalize_intensities as _norm_int
     from matchms.similarity import CosineGreedy as _CG
 
     # Build normalised query spectrum once (reused for every hit)
-    q_mz  = np.array([p["mz"]        for p in query_peaks], dtype=float)
-    q_int = np.array([p["intensity"]  for p in query_peaks], dtype=float)
     q_order = np.argsort(q_mz)
     _q_spec = _Spec(mz=q_mz[q_order], intensities=q_int[q_order],
                     metadata={"precursor_mz": precursor_mz})
@@ -1091,7 +1381,11 @@ def get_spectrum(spectrum_id: int, lib_id: Optional[str] = None) -> Dict:
         raise ValueError(f"Spectrum ID {spectrum_id} is out of range (0–{len(spectra)-1})")
 
     spectrum = spectra[spectrum_id]
+    peaks    = spectrum["peaks"]
     return {
-        "peaks":    spectrum["peaks"],
+        "peaks":    [
+            {"mz": mz, "intensity": it}
+            for mz, it in zip(peaks["mz"].tolist(), peaks["intensity"].tolist())
+        ],
         "metadata": spectrum["metadata"],
     }
@@ -1,13 +1,19 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 import asyncio
+import gzip
+import hashlib
 import json
 import math
+import os
 import time
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 import traceback
 
+import orjson
+
 from app.ml_service import MLService
 from app.models import (
     DatasetInfo, TrainingRequest, PredictionRequest,
@@ -28,16 +34,68 @@ app.add_middleware(
 # Service instance
 ml_service = MLService()
 
+# Executor dedicati: i job pesanti (training, matching, merge) girano su
+# cpu_pool, così non saturano il pool usato dagli endpoint leggeri.
+# Thread e non processi: i servizi tengono cache e indici in memoria
+# (modelli trainati, broad index) che devono restare condivisi.
+io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="io")
+cpu_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="cpu")
+
+
+def get_io_pool() -> ThreadPoolExecutor:
+    return io_pool
+
+
+def get_cpu_pool() -> ThreadPoolExecutor:
+    return cpu_pool
+
+
+@app.on_event("shutdown")
+def shutdown_pools():
+    io_pool.shutdown(wait=False, cancel_futures=True)
+    cpu_pool.shutdown(wait=False, cancel_futures=True)
+
+# Payload statici dopo lo startup: serializzati e compressi una volta sola,
+# poi serviti con ETag (304 in revalidazione) per tutta la vita del processo.
+# Le liste mutabili (dataset, cromatogrammi) passano una versione (mtime della
+# cartella) e usano no-cache, così il client rivalida sempre e vede subito i
+# file nuovi. Una voce per chiave: una nuova versione sostituisce la vecchia.
+_static_responses: Dict[str, Tuple[object, str, bytes, bytes]] = {}
+_STATIC_CACHE_CONTROL = "public, max-age=3600"
+_LISTING_CACHE_CONTROL = "no-cache"
+
+
+def cached_json_response(request: Request, key: str, producer: Callable[[], object],
+                         cache_control: str = _STATIC_CACHE_CONTROL, version: object = None) -> Response:
+    """Risposta JSON con ETag e gzip, calcolati alla prima richiesta per `key`
+    (e ricalcolati quando cambia `version`)."""
+    entry = _static_responses.get(key)
+    if entry is None or entry[0] != version:
+        body = orjson.dumps(producer())
+        etag = '"%s"' % hashlib.blake2b(body, digest_size=8).hexdigest()
+        entry = (version, etag, body, gzip.compress(body))
+        _static_responses[key] = entry
+    _, etag, body, gzipped = entry
+
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=gzipped, media_type="application/json", headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @app.get("/")
 def read_root():
     return {"message": "ML Training API is running"}
 
 @app.get("/datasets", response_model=List[str])
-def list_datasets():
+def list_datasets(request: Request):
     """Lista tutti i dataset disponibili"""
     try:
-        datasets = ml_service.list_datasets()
-        return datasets
+        return cached_json_response(request, "datasets", ml_service.list_datasets,
+                                    cache_control=_LISTING_CACHE_CONTROL,
+                                    version=ml_service.datasets_version())
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -83,12 +141,16 @@ async def train_models(websocket: WebSocket):
             "message": "Preparing dataset..."
         }))
 
-        X_train, X_test, y_train, y_test = ml_service.prepare_data(
+        loop = asyncio.get_running_loop()
+        X_train, X_test, y_train, y_test = await loop.run_in_executor(
+            get_cpu_pool(),
+            ml_service.prepare_data,
             dataset, test_size, random_state, selected_features
         )
         
-        # Allena ogni modello con progresso reale
-        loop = asyncio.get_event_loop()
+        # Allena ogni modello con progresso reale. Gli artefatti si scrivono
+        # in background mentre si allena il modello successivo
+        trained = []
         for idx, model_name in enumerate(models):
             try:
                 # Segnala inizio training
@@ -102,11 +164,21 @@ async def train_models(websocket: WebSocket):
 
                 # Esegui train_model in un thread separato
                 train_future = loop.run_in_executor(
-                    None,
+                    get_cpu_pool(),
                     ml_service.train_model,
                     dataset, model_name, X_train, y_train, X_test, y_test, selected_features
                 )
 
+                # Frame di progresso precompilato: a ogni tick si formatta
+                # solo il valore, senza ricostruire dict e JSON.
+                # Resta un frame di testo: il client fa JSON.parse(event.data).
+                name_json = json.dumps(model_name).replace("%", "%%")
+                msg_json = json.dumps(f"Training {model_name}... ")[:-1].replace("%", "%%")
+                tick_frame = (
+                    '{"status":"training","model":' + name_json
+                    + ',"progress":%.1f,"metrics":null,"message":' + msg_json + '%.0f%%"}'
+                )
+
                 # Manda aggiornamenti di progresso reali mentre il training gira
                 # Curva asintotica: avanza veloce all'inizio, rallenta verso il 90%
                 t_start = time.time()
@@ -114,16 +186,11 @@ async def train_models(websocket: WebSocket):
                 while not train_future.done():
                     elapsed = time.time() - t_start
                     progress = 90.0 * (1.0 - math.exp(-elapsed / tau))
-                    await websocket.send_text(json.dumps({
-                        "status": "training",
-                        "model": model_name,
-                        "progress": round(progress, 1),
-                        "metrics": None,
-                        "message": f"Training {model_name}... {progress:.0f}%"
-                    }))
+                    await websocket.send_text(tick_frame % (progress, progress))
                     await asyncio.sleep(0.15)
 
                 metrics = train_future.result()
+                trained.append(model_name)
 
                 # Completato — salta a 100%
                 await websocket.send_text(json.dumps({
@@ -146,6 +213,20 @@ async def train_models(websocket: WebSocket):
                     "message": f"{model_name} failed: {str(e)}"
                 }))
         
+        # Esito dei salvataggi, uno per modello: se fallisce, il modello
+        # resta usabile solo in memoria
+        for model_name in trained:
+            save_error = await loop.run_in_executor(
+                get_io_pool(), ml_service.wait_for_save, dataset, model_name
+            )
+            await websocket.send_text(json.dumps({
+                "status": "saved",
+                "model": model_name,
+                "saved": save_error is None,
+                "message": f"{model_name} saved" if save_error is None
+                           else f"{model_name} not saved: {save_error}"
+            }))
+
         # Training completato
         await websocket.send_text(json.dumps({
             "status": "all_completed",
@@ -186,7 +267,7 @@ async def feature_importance(request: FeatureImportanceRequest):
     try:
         loop = asyncio.get_running_loop()
         importances = await loop.run_in_executor(
-            None,
+            get_cpu_pool(),
             ml_service.get_feature_importance,
             request.dataset,
             request.model_name
@@ -207,9 +288,11 @@ from app.deep_spectrum_service import (
     get_embedding as ns_get_embedding,
     get_embeddings_3d as ns_get_embeddings_3d,
     get_all_embeddings as ns_get_all_embeddings,
+    get_all_embeddings_int8 as ns_get_all_embeddings_int8,
     project_query_to_3d as ns_project_query_to_3d,
     list_libraries as ns_list_libraries,
     list_chromatograms as ns_list_chromatograms,
+    chromatograms_version as ns_chromatograms_version,
     get_chromatogram as ns_get_chromatogram,
     spectral_match as ns_spectral_match,
     spec2vec_match as ns_spec2vec_match,
@@ -220,6 +303,12 @@ from app.deep_spectrum_service import (
     massbank_search as ns_massbank_search,
 )
 
+async def read_json_body(request: Request):
+    """Parse the raw request body with orjson (faster than Starlette's json.loads
+    on large peak lists)."""
+    return orjson.loads(await request.body())
+
+
 @app.get("/deep-spectrum/libraries")
 def deep_spectrum_libraries():
     """Lista le librerie spettrali disponibili nella cartella datasets."""
@@ -230,10 +319,10 @@ def deep_spectrum_libraries():
 
 
 @app.get("/deep-spectrum/library")
-def deep_spectrum_library(lib: Optional[str] = None):
+def deep_spectrum_library(request: Request, lib: Optional[str] = None):
     """Restituisce la libreria spettrale specificata (default: ECRFS)."""
     try:
-        return ns_get_library(lib)
+        return cached_json_response(request, f"library:{lib or ''}", lambda: ns_get_library(lib))
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -252,10 +341,10 @@ def deep_spectrum_embedding(spectrum_id: int, lib: Optional[str] = None):
 
 
 @app.get("/deep-spectrum/embeddings-3d")
-def deep_spectrum_embeddings_3d(lib: Optional[str] = None):
+def deep_spectrum_embeddings_3d(request: Request, lib: Optional[str] = None):
     """Restituisce le coordinate PCA 3-D per tutte le molecole della libreria specificata."""
     try:
-        return ns_get_embeddings_3d(lib)
+        return cached_json_response(request, f"embeddings-3d:{lib or ''}", lambda: ns_get_embeddings_3d(lib))
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -277,17 +366,17 @@ def deep_spectrum_spectrum(spectrum_id: int, lib: Optional[str] = None):
 async def deep_spectrum_project_query_3d(request: Request):
     """
     Project one or more query MS2 spectra into the ECRFS PCA 3-D space.
-    Body: { peaks: [{mz, intensity}], label?: str }
+    Body: { peaks: [{mz, intensity}] | {mz: [], intensity: []}, label?: str }
     Returns: { label, x, y, z }
     """
     try:
-        body        = await request.json()
+        body        = await read_json_body(request)
         query_peaks = body.get("peaks", [])
         label       = str(body.get("label", "Query"))
         lib_id      = body.get("lib") or None
         loop        = asyncio.get_running_loop()
         result      = await loop.run_in_executor(
-            None, lambda: ns_project_query_to_3d(query_peaks, label, lib_id)
+            get_cpu_pool(), lambda: ns_project_query_to_3d(query_peaks, label, lib_id)
         )
         return result
     except Exception as e:
@@ -295,19 +384,36 @@ async def deep_spectrum_project_query_3d(request: Request):
 
 
 @app.get("/deep-spectrum/all-embeddings")
-def deep_spectrum_all_embeddings():
+def deep_spectrum_all_embeddings(request: Request):
     """Restituisce i vettori 300-D per tutte le 102 molecole (per similarity search lato client)."""
     try:
-        return ns_get_all_embeddings()
+        return cached_json_response(request, "all-embeddings", ns_get_all_embeddings)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/deep-spectrum/all-embeddings-bin", response_class=Response)
+def deep_spectrum_all_embeddings_bin():
+    """
+    Stessi vettori di /all-embeddings, quantizzati int8 in formato binario
+    (header + scale per vettore + int8[n*dim]; vedi get_all_embeddings_int8).
+    I metadati delle molecole restano su /library (stesso ordine).
+    """
+    try:
+        return Response(content=ns_get_all_embeddings_int8(),
+                        media_type="application/octet-stream")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/deep-spectrum/chromatograms")
-def deep_spectrum_list_chromatograms():
+def deep_spectrum_list_chromatograms(request: Request):
     """Lista i file cromatogramma JSON disponibili."""
     try:
-        return ns_list_chromatograms()
+        # La versione segue l'mtime della cartella: nuovi file → nuova risposta/ETag
+        return cached_json_response(request, "chromatograms", ns_list_chromatograms,
+                                    cache_control=_LISTING_CACHE_CONTROL,
+                                    version=ns_chromatograms_version())
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -327,10 +433,10 @@ def deep_spectrum_get_chromatogram(filename: str):
 async def deep_spectrum_spectral_match(request: Request):
     """
     Real spectral matching via matchms ModifiedCosine.
-    Body: { peaks: [{mz, intensity}], precursor_mz, tolerance?, top_n?, lib? }
+    Body: { peaks: [{mz, intensity}] | {mz: [], intensity: []}, precursor_mz, tolerance?, top_n?, lib? }
     """
     try:
-        body        = await request.json()
+        body        = await read_json_body(request)
         query_peaks = body.get("peaks", [])
         precursor   = float(body.get("precursor_mz", 0.0))
         tolerance   = float(body.get("tolerance", 0.01))
@@ -339,7 +445,7 @@ async def deep_spectrum_spectral_match(request: Request):
 
         loop = asyncio.get_running_loop()
         results = await loop.run_in_executor(
-            None,
+            get_cpu_pool(),
             lambda: ns_spectral_match(query_peaks, precursor, tolerance, top_n, lib_id)
         )
         return {"results": results}
@@ -351,14 +457,14 @@ async def deep_spectrum_spectral_match(request: Request):
 async def deep_spectrum_anomaly_score(request: Request):
     """
     LOF-based anomaly detection in Spec2Vec embedding space.
-    Body: { peaks: [{mz, intensity}] }
+    Body: { peaks: [{mz, intensity}] | {mz: [], intensity: []} }
     """
     try:
-        body        = await request.json()
+        body        = await read_json_body(request)
         query_peaks = body.get("peaks", [])
         loop        = asyncio.get_running_loop()
         result      = await loop.run_in_executor(
-            None, lambda: ns_anomaly_score(query_peaks)
+            get_cpu_pool(), lambda: ns_anomaly_score(query_peaks)
         )
         return result
     except Exception as e:
@@ -369,17 +475,17 @@ async def deep_spectrum_anomaly_score(request: Request):
 async def deep_spectrum_spec2vec_match(request: Request):
     """
     Spec2Vec embedding similarity: cosine k-NN in 300-D embedding space.
-    Body: { peaks: [{mz, intensity}], top_n?, lib? }
+    Body: { peaks: [{mz, intensity}] | {mz: [], intensity: []}, top_n?, lib? }
     """
     try:
-        body        = await request.json()
+        body        = await read_json_body(request)
         query_peaks = body.get("peaks", [])
         top_n       = int(body.get("top_n", 10))
         lib_id      = body.get("lib") or None
 
         loop = asyncio.get_running_loop()
         results = await loop.run_in_executor(
-            None,
+            get_cpu_pool(),
             lambda: ns_spec2vec_match(query_peaks, top_n, lib_id)
         )
         return {"results": results}
@@ -404,7 +510,7 @@ async def deep_spectrum_build_broad_index():
     """
     try:
         loop = asyncio.get_running_loop()
-        status = await loop.run_in_executor(None, ns_start_build_broad_index)
+        status = await loop.run_in_executor(get_io_pool(), ns_start_build_broad_index)
         return status
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -414,17 +520,17 @@ async def deep_spectrum_build_broad_index():
 async def deep_spectrum_spec2vec_broad_match(request: Request):
     """
     Spec2Vec similarity search against the broad MassBank index (~8-12k spectra).
-    Body: { peaks: [{mz, intensity}], top_n? }
+    Body: { peaks: [{mz, intensity}] | {mz: [], intensity: []}, top_n? }
     Requires broad index to be built first.
     """
     try:
-        body        = await request.json()
+        body        = await read_json_body(request)
         query_peaks = body.get("peaks", [])
         top_n       = int(body.get("top_n", 10))
 
         loop = asyncio.get_running_loop()
         results = await loop.run_in_executor(
-            None,
+            get_cpu_pool(),
             lambda: ns_spec2vec_broad_match(query_peaks, top_n)
         )
         return {"results": results}
@@ -438,10 +544,10 @@ async def deep_spectrum_spec2vec_broad_match(request: Request):
 async def deep_spectrum_massbank_search(request: Request):
     """
     Global spectral identification via MassBank Europe (CosineGreedy similarity).
-    Body: { peaks: [{mz, intensity}], precursor_mz, ion_mode?, threshold?, top_n? }
+    Body: { peaks: [{mz, intensity}] | {mz: [], intensity: []}, precursor_mz, ion_mode?, threshold?, top_n? }
     """
     try:
-        body        = await request.json()
+        body        = await read_json_body(request)
         query_peaks = body.get("peaks", [])
         precursor   = float(body.get("precursor_mz", 0.0))
         ion_mode    = str(body.get("ion_mode", "POSITIVE"))
@@ -450,7 +556,7 @@ async def deep_spectrum_massbank_search(request: Request):
 
         loop = asyncio.get_running_loop()
         results = await loop.run_in_executor(
-            None,
+            get_cpu_pool(),
             lambda: ns_massbank_search(query_peaks, precursor, ion_mode, threshold, top_n),
         )
         return {"results": results}
@@ -480,7 +586,7 @@ async def datafusion_info(request: Request):
         body = await request.json()
         files = body.get("files", [])
         loop = asyncio.get_running_loop()
-        dfs = await loop.run_in_executor(None, lambda: df_parse_files(files))
+        dfs = await loop.run_in_executor(get_io_pool(), lambda: df_parse_files(files))
         infos = [df_get_file_info(name, df) for name, df in dfs.items()]
         return {"files": infos}
     except ValueError as e:
@@ -505,25 +611,25 @@ async def datafusion_merge(request: Request):
         dry_run = bool(body.get("dry_run", False))
 
         loop = asyncio.get_running_loop()
-        dfs = await loop.run_in_executor(None, lambda: df_parse_files(files))
+        dfs = await loop.run_in_executor(get_io_pool(), lambda: df_parse_files(files))
 
         if column_mapping:
             dfs = await loop.run_in_executor(
-                None, lambda: df_apply_mapping(dfs, column_mapping, key_column)
+                get_cpu_pool(), lambda: df_apply_mapping(dfs, column_mapping, key_column)
             )
 
         if dry_run:
             conflicts = await loop.run_in_executor(
-                None, lambda: df_detect_conflicts(dfs, key_column, label_col)
+                get_cpu_pool(), lambda: df_detect_conflicts(dfs, key_column, label_col)
             )
             result = await loop.run_in_executor(
-                None,
+                get_cpu_pool(),
                 lambda: df_merge_datasets(dfs, key_column, label_col, rules, dry_run=True),
             )
             return {"conflicts": conflicts, "stats": result["stats"]}
 
         result = await loop.run_in_executor(
-            None,
+            get_cpu_pool(),
             lambda: df_merge_datasets(dfs, key_column, label_col, rules, dry_run=False),
         )
         return result
@@ -1,5 +1,15 @@
 import pandas as pd
 import numpy as np
+
+# Implementazioni oneDAL di scikit-learn-intelex quando installato (opzionale).
+# La patch va applicata prima di importare gli stimatori
+try:
+    from sklearnex import patch_sklearn
+    patch_sklearn(["random_forest_classifier", "svc", "knn_classifier"], verbose=False)
+    SKLEARNEX = True
+except ImportError:
+    SKLEARNEX = False
+
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import AdaBoostClassifier, GradientBoostingClassifier, RandomForestClassifier
 from sklearn.tree import DecisionTreeClassifier
@@ -7,20 +17,74 @@ from sklearn.linear_model import SGDClassifier
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.naive_bayes import GaussianNB
 from sklearn.svm import SVC
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix, r2_score, roc_auc_score
+from sklearn.metrics import precision_score, recall_score, f1_score, roc_auc_score
 from sklearn.inspection import permutation_importance
+from threadpoolctl import threadpool_limits
 import joblib
+from joblib import Parallel, delayed
+import orjson
+import contextlib
+import datetime
+import functools
+import io
+import logging
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import json
 import time
 
+logger = logging.getLogger(__name__)
+
+# Parser CSV multi-thread di pyarrow quando disponibile (opzionale)
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = "c"
+
+# Compressione degli artefatti: lz4 se installato (quasi alla velocità di
+# memcpy), altrimenti zlib al livello più veloce
+try:
+    import lz4  # noqa: F401
+    MODEL_COMPRESS = ("lz4", 1)
+except ImportError:
+    MODEL_COMPRESS = ("zlib", 1)
+
+# Scrittura degli artefatti su disco in background: il tempo di I/O non
+# rientra nel training (né nel training_time riportato)
+_io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-io")
+
 class MLService:
-    def __init__(self):
+    TASK_SAMPLE_SIZE = 10_000
+    RF_DISTRIBUTED_MIN_ROWS = 500_000
+    # Boosting su alberi: lo splitter legge X per colonna, in ordine F
+    # (colonne contigue) il fit è più rapido
+    FORTRAN_MODELS = ("Gradient Boosting", "AdaBoost")
+    # Cache in memoria limitate (LRU): su un server longevo non crescono senza fine
+    MAX_CACHED_DATASETS = 8
+    MAX_CACHED_MODELS = 32
+    # Split per dataset: ognuno tiene una copia di X (train + test)
+    MAX_CACHED_SPLITS = 2
+    
+    def __init__(self, max_parallel_fits: int = 1):
         self.datasets_dir = Path("datasets")
         self.models_dir = Path("trained_models")
         self.models_dir.mkdir(exist_ok=True)
         
+        # Quota di core per singolo fit. Il pool dell'API può lanciare più
+        # training insieme: il semaforo ne lascia girare al massimo
+        # max_parallel_fits, così thread BLAS/OpenMP e n_jobs della Random
+        # Forest non si moltiplicano (con il default 1 ogni fit ha tutti i core)
+        self.fit_threads = max(1, (os.cpu_count() or 1) // max_parallel_fits)
+        self._fit_slots = threading.BoundedSemaphore(max_parallel_fits)
+        # threadpool_limits è globale al processo: il primo fit attivo imposta
+        # il limite, l'ultimo che termina lo ripristina
+        self._fit_lock = threading.Lock()
+        self._active_fits = 0
+        self._thread_limits = None
+        
         self.model_classes = {
             "AdaBoost": AdaBoostClassifier,
             "Gradient Boosting": GradientBoostingClassifier,
@@ -32,8 +96,52 @@ class MLService:
             "SVM": SVC
         }
         
-        self.trained_models = {}
-        self.datasets_cache = {}
+        self.model_params = {
+            "AdaBoost": {"n_estimators": 100, "learning_rate": 1.0, "random_state": 42},
+            "Gradient Boosting": {"n_estimators": 100, "learning_rate": 0.1, "max_depth": 3, "random_state": 42},
+            "Random Forest": {"n_estimators": 100, "random_state": 42, "n_jobs": self.fit_threads},
+            "Decision Tree": {"random_state": 42},
+            "SGD": {"loss": "hinge", "max_iter": 1000, "random_state": 42},
+            "KNN": {"n_neighbors": 5},
+            "Naive Bayes": {},
+            "SVM": {"probability": True, "random_state": 42}
+        }
+        
+        # Costruttori già specializzati con i loro parametri: il training
+        # fa solo self.model_factories[model_name]()
+        self.model_factories = {
+            name: functools.partial(cls, **self.model_params[name])
+            for name, cls in self.model_classes.items()
+        }
+        
+        self.trained_models = OrderedDict()
+        self.datasets_cache = OrderedDict()
+        self._pending_writes = {}
+        self._meta_cache = {}  # dataset -> ((n_file, mtime massimo), lista metadata)
+    
+    @staticmethod
+    def _encode_labels(*arrays):
+        """
+        Codifica più array di etichette in interi 0..K-1 con un unico np.unique
+        sulla concatenazione (stesso ordinamento delle classi usato da sklearn).
+        Returns: (K, [codici per ciascun array])
+        """
+        classes, codes = np.unique(np.concatenate(arrays), return_inverse=True)
+        bounds = np.cumsum([len(a) for a in arrays])[:-1]
+        return len(classes), np.split(codes, bounds)
+    
+    @staticmethod
+    def _r2_score(y_true, y_pred):
+        """R² con sole riduzioni numpy sui residui (stesso risultato di r2_score)"""
+        y_true = np.asarray(y_true, dtype=np.float64)
+        diff = np.asarray(y_pred, dtype=np.float64) - y_true
+        centered = y_true - y_true.mean()
+        ss_res = float(np.dot(diff, diff))
+        ss_tot = float(np.dot(centered, centered))
+        if ss_tot == 0:
+            # Come sklearn (force_finite): target costante
+            return 1.0 if ss_res == 0 else 0.0
+        return 1.0 - ss_res / ss_tot
     
     def _detect_task_type(self, y):
         """
@@ -43,14 +151,29 @@ class MLService:
         if y.dtype == 'object' or isinstance(y[0], str):
             return 'classification'
         
-        unique_values = len(np.unique(y))
         total_values = len(y)
         
+        # Su target grandi decide su un campione; np.unique completo
+        # solo se il campione non basta
+        if total_values > self.TASK_SAMPLE_SIZE:
+            sample = np.random.default_rng(0).choice(y, self.TASK_SAMPLE_SIZE, replace=False)
+            sample_unique = len(np.unique(sample))
+            if sample_unique >= 0.05 * total_values:
+                return 'regression'
+            if sample_unique / self.TASK_SAMPLE_SIZE < 0.05:
+                return 'classification'
+        
+        unique_values = len(np.unique(y))
+        
         if unique_values / total_values < 0.05:
             return 'classification'
         
         return 'regression'
         
+    def datasets_version(self):
+        """Mtime (ns) della cartella testing_station: cambia quando si aggiungono/rimuovono file"""
+        return (self.datasets_dir / "testing_station").stat().st_mtime_ns
+
     def list_datasets(self):
         """Lista tutti i dataset CSV nella sottocartella testing_station"""
         datasets = []
@@ -61,13 +184,12 @@ class MLService:
     def load_dataset(self, filename: str):
         """Carica e analizza un dataset"""
         if filename in self.datasets_cache:
+            self.datasets_cache.move_to_end(filename)
             return self.datasets_cache[filename]["info"]
 
         filepath = self.datasets_dir / "testing_station" / filename
-        try:
-            df = pd.read_csv(filepath)
-        except UnicodeDecodeError:
-            df = pd.read_csv(filepath, encoding='latin-1')
+        stat = filepath.stat()
+        df = self._read_csv(filepath)
         
         # Assume che l'ultima colonna sia il target
         target_col = df.columns[-1]
@@ -129,79 +251,196 @@ class MLService:
             "preview": preview,
         }
         
-        self.datasets_cache[filename] = {
+        # Matrice delle feature numeriche e target estratti una volta sola:
+        # prepare_data lavora su questi array senza ripassare dal DataFrame.
+        # float32 C-contiguo è il formato nativo degli alberi sklearn: fit e
+        # predict dei modelli ad albero non fanno copie/conversioni dell'input
+        self._cache_put(self.datasets_cache, filename, {
             "info": info,
-            "data": df
-        }
+            "data": df,
+            "X": np.ascontiguousarray(df[feature_cols].to_numpy(dtype=np.float32)),
+            "y": df[target_col].to_numpy(),
+            "y_valid": df[target_col].notna().to_numpy(),
+            # impronta del CSV: le righe di test salvate valgono solo per questo file
+            "fingerprint": {"rows": len(df), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+            # ultimi split calcolati, per (test_size, random_state, colonne),
+            # e righe del dataset finite nel test set di ciascuno (LRU)
+            "splits": OrderedDict(),
+            "test_rows": OrderedDict()
+        }, self.MAX_CACHED_DATASETS)
         
         return info
     
+    @staticmethod
+    def _read_csv(filepath: Path) -> pd.DataFrame:
+        """Legge un CSV in UTF-8, con fallback a latin-1"""
+        # L'encoding si decide sui byte: il parser pyarrow non solleva
+        # UnicodeDecodeError ma restituisce bytes grezzi per l'input non valido
+        raw = filepath.read_bytes()
+        try:
+            raw.decode("utf-8")
+            encoding = "utf-8"
+        except UnicodeDecodeError:
+            encoding = "latin-1"
+        df = pd.read_csv(io.BytesIO(raw), engine=CSV_ENGINE, encoding=encoding)
+        # pyarrow converte date/orari in timestamp: quelle colonne si rileggono
+        # col parser C, così restano stringhe col testo originale
+        temporal = []
+        for col in df.columns:
+            if df[col].dtype.kind == "M":
+                temporal.append(col)
+            elif df[col].dtype == object:
+                first = df[col].first_valid_index()
+                if first is not None and isinstance(df[col].at[first], (datetime.date, datetime.time)):
+                    temporal.append(col)
+        if temporal:
+            text = pd.read_csv(io.BytesIO(raw), engine="c", encoding=encoding,
+                               usecols=temporal, dtype={col: str for col in temporal})
+            for col in temporal:
+                df[col] = text[col]
+        return df
+    
+    @staticmethod
+    def _cache_put(cache: OrderedDict, key, value, max_entries: int):
+        """Inserisce in una cache LRU ed elimina le voci meno recenti"""
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > max_entries:
+            cache.popitem(last=False)
+    
+    def _dataset_cache(self, dataset: str):
+        """Voce di cache del dataset, ricaricata dal CSV se uscita dalla LRU"""
+        self.load_dataset(dataset)
+        return self.datasets_cache[dataset]
+    
+    @staticmethod
+    def _feature_cols(cached, selected_features):
+        """Colonne numeriche usate dal modello (tutte se nessuna selezione)"""
+        numeric_features = cached["info"]["features"]
+        if selected_features:
+            # Filtra solo le colonne numeriche tra quelle selezionate
+            return [c for c in selected_features if c in numeric_features]
+        return numeric_features
+    
+    def _test_set(self, dataset: str, metadata: dict, test_size: float = 0.2, random_state: int = 42):
+        """
+        Test set per predict: dallo split in cache se già calcolato, altrimenti
+        dalle righe salvate nei metadata al training (niente nuovo split)
+        """
+        cached = self._dataset_cache(dataset)
+        cols = self._feature_cols(cached, metadata.get("selected_features"))
+        
+        saved = metadata.get("test_split")
+        rows = None
+        # Righe salvate usabili solo se il CSV è lo stesso del training
+        if ((test_size, random_state, tuple(cols)) not in cached["splits"] and saved
+                and (saved["test_size"], saved["random_state"]) == (test_size, random_state)
+                and saved.get("fingerprint") == cached["fingerprint"]):
+            rows = np.asarray(saved["rows"], dtype=np.intp)
+            if rows.size and (rows.min() < 0 or rows.max() >= len(cached["X"])):
+                rows = None
+        if rows is None:
+            _, X_test, _, y_test = self.prepare_data(dataset, test_size, random_state, metadata.get("selected_features"))
+            return X_test, y_test
+        
+        col_idx = [cached["info"]["features"].index(c) for c in cols]
+        X_test = np.ascontiguousarray(cached["X"][rows][:, col_idx])
+        return X_test, cached["y"][rows]
+    
     def prepare_data(self, filename: str, test_size: float, random_state: int, selected_features: list = None):
-        """Prepara i dati per training e test"""
-        if filename not in self.datasets_cache:
-            self.load_dataset(filename)
+        """Prepara i dati per training e test.
 
-        df = self.datasets_cache[filename]["data"].copy()
-        target_col = df.columns[-1]
-        task_type = self.datasets_cache[filename]["info"]["task_type"]
-        numeric_features = self.datasets_cache[filename]["info"]["features"]
+        Lo split è memorizzato nella cache del dataset: training e predict con
+        gli stessi parametri riusano gli stessi array (da non modificare).
+        """
+        cached = self._dataset_cache(filename)
+        task_type = cached["info"]["task_type"]
+        numeric_features = cached["info"]["features"]
+        cols = self._feature_cols(cached, selected_features)
 
-        if selected_features:
-            # Filtra solo le colonne numeriche tra quelle selezionate
-            cols = [c for c in selected_features if c in numeric_features]
-        else:
-            cols = numeric_features
+        split_key = (test_size, random_state, tuple(cols))
+        if split_key in cached["splits"]:
+            cached["splits"].move_to_end(split_key)
+            cached["test_rows"].move_to_end(split_key)
+            return cached["splits"][split_key]
+
+        col_idx = [numeric_features.index(c) for c in cols]
+        X = cached["X"][:, col_idx]
 
         # Rimuovi righe con NaN nelle colonne usate
-        subset = df[cols + [target_col]].dropna()
-        X = subset[cols].values
-        y = subset[target_col].values
+        valid = cached["y_valid"] & ~np.isnan(X).any(axis=1)
+        X = np.ascontiguousarray(X[valid])
+        y = cached["y"][valid]
+        rows = np.flatnonzero(valid)
 
         stratify = y if task_type == 'classification' else None
 
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=test_size, random_state=random_state, stratify=stratify
+        # Le righe seguono la stessa permutazione di X e y
+        *split, _, test_rows = train_test_split(
+            X, y, rows, test_size=test_size, random_state=random_state, stratify=stratify
         )
+        self._cache_put(cached["splits"], split_key, split, self.MAX_CACHED_SPLITS)
+        self._cache_put(cached["test_rows"], split_key, test_rows, self.MAX_CACHED_SPLITS)
+        # La copia F-order di uno split uscito dalla cache non serve più
+        fortran = cached.get("fortran")
+        if fortran is not None and not any(sp[0] is fortran[0] for sp in cached["splits"].values()):
+            del cached["fortran"]
 
-        return X_train, X_test, y_train, y_test
+        return split
+    
+    @contextlib.contextmanager
+    def _fit_slot(self):
+        """Uno dei max_parallel_fits posti di training, con i thread limitati"""
+        with self._fit_slots:
+            with self._fit_lock:
+                if self._active_fits == 0:
+                    self._thread_limits = threadpool_limits(limits=self.fit_threads)
+                self._active_fits += 1
+            try:
+                yield
+            finally:
+                with self._fit_lock:
+                    self._active_fits -= 1
+                    if self._active_fits == 0:
+                        self._thread_limits.restore_original_limits()
+                        self._thread_limits = None
     
     def train_model(self, dataset: str, model_name: str, X_train, y_train, X_test, y_test, selected_features=None):
         """Allena un singolo modello"""
-        start_time = time.time()
-        
-        task_type = self.datasets_cache[dataset]["info"]["task_type"]
-        
-        ModelClass = self.model_classes[model_name]
-        
-        params = {
-            "AdaBoost": {"n_estimators": 100, "learning_rate": 1.0, "random_state": 42},
-            "Gradient Boosting": {"n_estimators": 100, "learning_rate": 0.1, "max_depth": 3, "random_state": 42},
-            "Random Forest": {"n_estimators": 100, "random_state": 42, "n_jobs": -1},
-            "Decision Tree": {"random_state": 42},
-            "SGD": {"loss": "hinge", "max_iter": 1000, "random_state": 42},
-            "KNN": {"n_neighbors": 5},
-            "Naive Bayes": {},
-            "SVM": {"probability": True, "random_state": 42}
-        }
-        
-        model = ModelClass(**params[model_name])
-        model.fit(X_train, y_train)
-        
-        training_time = time.time() - start_time
+        task_type = self._dataset_cache(dataset)["info"]["task_type"]
+        
+        # training_time parte dopo l'attesa del posto libero
+        with self._fit_slot():
+            start_time = time.time()
+            # Con sklearnex la foresta è già parallela in oneDAL e gli estimators_
+            # non si possono unire: niente mini-foreste
+            if model_name == "Random Forest" and not SKLEARNEX and len(X_train) > self.RF_DISTRIBUTED_MIN_ROWS:
+                model = self._train_rf_distributed(X_train, y_train)
+            else:
+                model = self.model_factories[model_name]()
+                X_fit = self._fortran_view(dataset, X_train) if model_name in self.FORTRAN_MODELS else X_train
+                model.fit(X_fit, y_train)
+            training_time = time.time() - start_time
         
         y_pred = model.predict(X_test)
         y_train_pred = model.predict(X_train)
         
+        # Etichette codificate una sola volta (stringhe/oggetti → interi 0..K-1)
+        # per tutte le metriche che seguono
+        _, (y_train_c, y_train_pred_c, y_test_c, y_pred_c) = self._encode_labels(
+            y_train, y_train_pred, y_test, y_pred
+        )
+        
         metrics = {
-            "accuracy": float(accuracy_score(y_test, y_pred)),
-            "precision": float(precision_score(y_test, y_pred, average='weighted', zero_division=0)),
-            "recall": float(recall_score(y_test, y_pred, average='weighted', zero_division=0)),
-            "f1_score": float(f1_score(y_test, y_pred, average='weighted', zero_division=0)),
+            "accuracy": float(np.mean(y_test_c == y_pred_c)),
+            "precision": float(precision_score(y_test_c, y_pred_c, average='weighted', zero_division=0)),
+            "recall": float(recall_score(y_test_c, y_pred_c, average='weighted', zero_division=0)),
+            "f1_score": float(f1_score(y_test_c, y_pred_c, average='weighted', zero_division=0)),
         }
         
         if task_type == 'regression':
-            metrics["r2_score"] = float(r2_score(y_test, y_pred))
-            metrics["train_r2"] = float(r2_score(y_train, y_train_pred))
+            metrics["r2_score"] = self._r2_score(y_test, y_pred)
+            metrics["train_r2"] = self._r2_score(y_train, y_train_pred)
         else:
             metrics["r2_score"] = None
             metrics["train_r2"] = None
@@ -222,19 +461,28 @@ class MLService:
         else:
             metrics["auc_roc"] = None
 
-        metrics["train_accuracy"] = float(accuracy_score(y_train, y_train_pred))
+        metrics["train_accuracy"] = float(np.mean(y_train_c == y_train_pred_c))
         metrics["overfit_gap"] = metrics["train_accuracy"] - metrics["accuracy"]
         metrics["training_time_seconds"] = round(training_time, 3)
         metrics["n_train_samples"] = len(y_train)
         metrics["n_test_samples"] = len(y_test)
         
         model_key = f"{dataset}_{model_name.replace(' ', '_')}"
-        model_path = self.models_dir / f"{model_key}.joblib"
-        joblib.dump(model, model_path)
         
-        from datetime import datetime
-        all_features = self.datasets_cache[dataset]["info"]["features"]
+        cached = self._dataset_cache(dataset)
+        all_features = cached["info"]["features"]
         used_features = selected_features if selected_features else all_features
+        
+        # Righe del test set, per ricostruirlo in predict senza rifare lo split
+        split_key = next((k for k, split in cached["splits"].items() if split[1] is X_test), None)
+        test_split = None
+        if split_key is not None:
+            test_split = {
+                "test_size": split_key[0],
+                "random_state": split_key[1],
+                "fingerprint": cached["fingerprint"],
+                "rows": cached["test_rows"][split_key]
+            }
 
         metadata = {
             "dataset": dataset,
@@ -243,99 +491,111 @@ class MLService:
             "metrics": metrics,
             "feature_count": X_train.shape[1],
             "selected_features": used_features,
-            "trained_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "parameters": params[model_name]
+            "trained_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "parameters": self.model_params[model_name],
+            "test_split": test_split
         }
         
-        metadata_path = self.models_dir / f"{model_key}_metadata.json"
-        with open(metadata_path, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        self._pending_writes[model_key] = _io_pool.submit(
+            self._save_model_artifact, model_key, metadata, model
+        )
         
-        self.trained_models[model_key] = {
+        self._cache_put(self.trained_models, model_key, {
             "model": model,
             "metadata": metadata
-        }
+        }, self.MAX_CACHED_MODELS)
         
         return metrics
     
     def predict(self, dataset: str, model_name: str):
         """Usa un modello trainato per fare predizioni sul test set"""
         model_key = f"{dataset}_{model_name.replace(' ', '_')}"
+        self._load_trained_model(model_key)
         
-        if model_key not in self.trained_models:
-            model_path = self.models_dir / f"{model_key}.joblib"
-            if not model_path.exists():
-                raise ValueError(f"Model {model_key} not found. Train it first.")
-            
-            model = joblib.load(model_path)
-            
-            metadata_path = self.models_dir / f"{model_key}_metadata.json"
-            with open(metadata_path, 'r') as f:
-                metadata = json.load(f)
-            
-            self.trained_models[model_key] = {
-                "model": model,
-                "metadata": metadata
-            }
-        
-        task_type = self.trained_models[model_key]["metadata"]["task_type"]
-        selected_features = self.trained_models[model_key]["metadata"].get("selected_features")
+        metadata = self.trained_models[model_key]["metadata"]
+        task_type = metadata["task_type"]
 
-        X_train, X_test, y_train, y_test = self.prepare_data(dataset, 0.2, 42, selected_features)
+        X_test, y_test = self._test_set(dataset, metadata)
         
         model = self.trained_models[model_key]["model"]
         y_pred = model.predict(X_test)
         
-        results = []
-        for i in range(len(y_test)):
-            result_dict = {
+        # Confronti/errori calcolati in un colpo solo su tutto il test set;
+        # .tolist() converte in tipi Python senza passare elemento per elemento
+        n = len(y_test)
+        if task_type == 'classification':
+            correct = (y_test == y_pred).tolist()
+            errors = [None] * n
+        else:
+            correct = [None] * n
+            errors = np.abs(y_test.astype(np.float64) - y_pred.astype(np.float64)).tolist()
+        
+        results = [
+            {
                 "sample_id": i,
-                "true_value": str(y_test[i]),
-                "predicted_value": str(y_pred[i]),
+                "true_value": str(t),
+                "predicted_value": str(p),
+                "correct": c,
+                "error": e,
             }
-            
-            if task_type == 'classification':
-                result_dict["correct"] = bool(y_test[i] == y_pred[i])
-                result_dict["error"] = None
-            else:
-                result_dict["correct"] = None
-                result_dict["error"] = float(abs(y_test[i] - y_pred[i]))
-            
-            results.append(result_dict)
+            for i, (t, p, c, e) in enumerate(zip(y_test.tolist(), y_pred.tolist(), correct, errors))
+        ]
+        
+        n_classes, (y_test_c, y_pred_c) = self._encode_labels(y_test, y_pred)
+        # Matrice di confusione K×K con un solo bincount sui codici
+        cm = np.bincount(n_classes * y_test_c + y_pred_c, minlength=n_classes * n_classes)
         
         metrics = {
-            "accuracy": float(accuracy_score(y_test, y_pred)),
-            "precision": float(precision_score(y_test, y_pred, average='weighted', zero_division=0)),
-            "recall": float(recall_score(y_test, y_pred, average='weighted', zero_division=0)),
-            "f1_score": float(f1_score(y_test, y_pred, average='weighted', zero_division=0)),
-            "confusion_matrix": confusion_matrix(y_test, y_pred).tolist()
+            "accuracy": float(np.mean(y_test_c == y_pred_c)),
+            "precision": float(precision_score(y_test_c, y_pred_c, average='weighted', zero_division=0)),
+            "recall": float(recall_score(y_test_c, y_pred_c, average='weighted', zero_division=0)),
+            "f1_score": float(f1_score(y_test_c, y_pred_c, average='weighted', zero_division=0)),
+            "confusion_matrix": cm.reshape(n_classes, n_classes).tolist()
         }
         
         if task_type == 'regression':
-            metrics["r2_score"] = float(r2_score(y_test, y_pred))
+            metrics["r2_score"] = self._r2_score(y_test, y_pred)
         else:
             metrics["r2_score"] = None
         
         return results, metrics
     
+    def _fortran_view(self, dataset: str, X_train):
+        """Copia F-order di X_train, creata una volta e condivisa tra i modelli"""
+        cached = self._dataset_cache(dataset)
+        entry = cached.get("fortran")
+        if entry is None or entry[0] is not X_train:
+            entry = (X_train, np.asfortranarray(X_train))
+            cached["fortran"] = entry
+        return entry[1]
+    
+    def _train_rf_distributed(self, X_train, y_train):
+        """
+        Random Forest su dataset molto grandi: mini-foreste in processi
+        separati (loky) con random_state diversi, poi unione degli estimators_
+        """
+        params = self.model_params["Random Forest"]
+        n_estimators = params["n_estimators"]
+        n_splits = max(2, min(self.fit_threads, n_estimators))
+        sizes = [n_estimators // n_splits + (i < n_estimators % n_splits) for i in range(n_splits)]
+        base = {**params, "n_jobs": 1}
+        
+        subs = Parallel(n_jobs=n_splits, backend="loky")(
+            delayed(RandomForestClassifier(**{**base, "n_estimators": size,
+                                              "random_state": params["random_state"] + i}).fit)(X_train, y_train)
+            for i, size in enumerate(sizes)
+        )
+        
+        merged = subs[0]
+        merged.estimators_ = [tree for sub in subs for tree in sub.estimators_]
+        merged.n_estimators = n_estimators
+        merged.set_params(n_jobs=params["n_jobs"])
+        return merged
+    
     def get_feature_importance(self, dataset: str, model_name: str):
         """Estrae feature importance da un modello trainato"""
         model_key = f"{dataset}_{model_name.replace(' ', '_')}"
-
-        if model_key not in self.trained_models:
-            model_path = self.models_dir / f"{model_key}.joblib"
-            if not model_path.exists():
-                raise ValueError(f"Model {model_key} not found. Train it first.")
-
-            model = joblib.load(model_path)
-            metadata_path = self.models_dir / f"{model_key}_metadata.json"
-            with open(metadata_path, 'r') as f:
-                metadata = json.load(f)
-
-            self.trained_models[model_key] = {
-                "model": model,
-                "metadata": metadata
-            }
+        self._load_trained_model(model_key)
 
         model = self.trained_models[model_key]["model"]
 
@@ -370,9 +630,7 @@ class MLService:
         # Recupera nomi feature da metadata (rispetta selezione colonne) o dal dataset cache
         feature_names = self.trained_models[model_key]["metadata"].get("selected_features")
         if not feature_names:
-            if dataset not in self.datasets_cache:
-                self.load_dataset(dataset)
-            feature_names = self.datasets_cache[dataset]["info"]["features"]
+            feature_names = self._dataset_cache(dataset)["info"]["features"]
 
         # Crea lista ordinata per importanza decrescente
         feature_importance_list = [
@@ -385,9 +643,100 @@ class MLService:
 
     def get_trained_models(self, dataset: str):
         """Ottieni lista di modelli trainati per un dataset"""
+        self._flush_pending_writes()
+        files = list(self.models_dir.glob(f"{dataset}_*.model"))
+        # Riparsa gli header solo se l'insieme di artefatti è cambiato
+        stamp = (len(files), max((f.stat().st_mtime_ns for f in files), default=0))
+        cached = self._meta_cache.get(dataset)
+        if cached is not None and cached[0] == stamp:
+            return list(cached[1])
         trained = []
-        for file in self.models_dir.glob(f"{dataset}_*_metadata.json"):
-            with open(file, 'r') as f:
-                metadata = json.load(f)
-                trained.append(metadata)
-        return trained
\ No newline at end of file
+        for file in files:
+            with open(file, 'rb') as f:
+                header = self._read_artifact_header(f)
+            # Lo split di test (e l'impronta del CSV) serve solo a predict
+            header.pop("test_split", None)
+            trained.append(header)
+        self._meta_cache[dataset] = (stamp, trained)
+        return list(trained)
+
+    # Artefatto su disco: un solo file per modello.
+    #   [4 byte little-endian: lunghezza N][N byte: metadata JSON]
+    #   [test_split.n_rows × int64: righe del test set][modello joblib]
+    # L'header permette di leggere i metadata senza deserializzare il modello.
+
+    def _save_model_artifact(self, model_key: str, metadata: dict, model):
+        """Scrive metadata + modello in un unico file (rename atomico)"""
+        path = self.models_dir / f"{model_key}.model"
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        # Le righe di test stanno in un blocco binario dopo l'header: l'header
+        # (riletto da get_trained_models) resta piccolo
+        rows = b""
+        test_split = metadata.get("test_split")
+        if test_split is not None:
+            rows = np.asarray(test_split["rows"], dtype="<i8").tobytes()
+            test_split = {k: v for k, v in test_split.items() if k != "rows"}
+            metadata = {**metadata, "test_split": {**test_split, "n_rows": len(rows) // 8}}
+        meta_bytes = orjson.dumps(metadata, option=orjson.OPT_SERIALIZE_NUMPY)
+        with open(tmp_path, 'wb') as f:
+            f.write(len(meta_bytes).to_bytes(4, "little"))
+            f.write(meta_bytes)
+            f.write(rows)
+            joblib.dump(model, f, compress=MODEL_COMPRESS, protocol=5)
+        os.replace(tmp_path, path)
+
+    def wait_for_save(self, dataset: str, model_name: str):
+        """Attende la scrittura dell'artefatto; restituisce l'errore o None se salvato"""
+        model_key = f"{dataset}_{model_name.replace(' ', '_')}"
+        future = self._pending_writes.get(model_key)
+        if future is None:
+            return None
+        try:
+            future.result()
+        except Exception as e:
+            return str(e)
+        return None
+
+    def _flush_pending_writes(self):
+        """Attende le scritture in background (chi legge da disco le vede tutte)"""
+        for model_key, future in list(self._pending_writes.items()):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error("Error saving model %s: %s", model_key, e)
+            if self._pending_writes.get(model_key) is future:
+                del self._pending_writes[model_key]
+
+    @staticmethod
+    def _read_artifact_header(f):
+        """Legge i metadata dall'header di un artefatto aperto in 'rb'"""
+        size = int.from_bytes(f.read(4), "little")
+        return orjson.loads(f.read(size))
+
+    def _load_trained_model(self, model_key: str):
+        """Carica modello e metadata da disco se non già in memoria"""
+        if model_key in self.trained_models:
+            self.trained_models.move_to_end(model_key)
+            return self.trained_models[model_key]
+
+        # Un modello uscito dalla cache può essere ancora in scrittura
+        pending = self._pending_writes.get(model_key)
+        if pending is not None:
+            pending.result()
+
+        path = self.models_dir / f"{model_key}.model"
+        if not path.exists():
+            raise ValueError(f"Model {model_key} not found. Train it first.")
+
+        with open(path, 'rb') as f:
+            metadata = self._read_artifact_header(f)
+            test_split = metadata.get("test_split")
+            if test_split is not None and "n_rows" in test_split:
+                test_split["rows"] = np.frombuffer(f.read(8 * test_split.pop("n_rows")), dtype="<i8")
+            model = joblib.load(f)
+
+        self._cache_put(self.trained_models, model_key, {
+            "model": model,
+            "metadata": metadata
+        }, self.MAX_CACHED_MODELS)
+        return self.trained_models[model_key]
\ No newline at end of file
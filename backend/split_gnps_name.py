@@ -17,36 +17,38 @@ OUTPUT = Path(__file__).parent / "datasets/deep_spectrum/GNPS_collection_pestici
 # e.g. " M+H", " M-H", " M-H2O+H", " M+Na", " M+2H", etc.
 ADDUCT_RE = re.compile(r"\s+(M(?:[+-][A-Za-z0-9]+)+)\s*$")
 
+# Whole NAME= line, matched in one pass over the file contents
+NAME_LINE_RE = re.compile(r"^NAME=(.*)$", re.MULTILINE)
+
 total = 0
 parsed = 0
 failed = []
 
+
+def split_name(match):
+    global total, parsed
+    total += 1
+    raw = match.group(1).strip()
+
+    # Split on underscore, max 2 splits → [common, formula, rest]
+    parts = raw.split("_", 2)
+
+    if len(parts) == 3:
+        common, formula, rest = parts
+
+        # Strip trailing adduct from systematic name
+        systematic = ADDUCT_RE.sub("", rest).strip()
+
+        parsed += 1
+        return f"NAME={common}\nFORMULA={formula}\nSYSTEMATIC={systematic}"
+
+    # Can't parse → keep original and report
+    failed.append(raw)
+    return match.group(0)
+
+
 with INPUT.open("r", encoding="utf-8") as fin, OUTPUT.open("w", encoding="utf-8") as fout:
-    for line in fin:
-        if not line.startswith("NAME="):
-            fout.write(line)
-            continue
-
-        total += 1
-        raw = line[len("NAME="):].strip()
-
-        # Split on underscore, max 2 splits → [common, formula, rest]
-        parts = raw.split("_", 2)
-
-        if len(parts) == 3:
-            common, formula, rest = parts
-
-            # Strip trailing adduct from systematic name
-            systematic = ADDUCT_RE.sub("", rest).strip()
-
-            fout.write(f"NAME={common}\n")
-            fout.write(f"FORMULA={formula}\n")
-            fout.write(f"SYSTEMATIC={systematic}\n")
-            parsed += 1
-        else:
-            # Can't parse → keep original and report
-            fout.write(line)
-            failed.append(raw)
+    fout.write(NAME_LINE_RE.sub(split_name, fin.read()))
 
 print(f"Spettri processati : {total}")
 print(f"  Parsati OK       : {parsed}")